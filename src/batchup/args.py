@@ -7,9 +7,12 @@ class Namespace(argparse.Namespace):
         super().__init__(*args, **kwargs)
 
         self.dry_run: bool
+        self.keep: Optional[int]
         self.keep_symlinks: bool
         self.orphans: bool
         self.root: Optional[str]
+        self.snapshot: bool
+        self.usage: bool
         self.verbose: int
 
         self.rules: str
@@ -21,9 +24,12 @@ def parse_args() -> Namespace:
     parser.formatter_class = argparse.RawTextHelpFormatter
 
     parser.add_argument("-n", "--dry-run", action="store_true", help="Don't copy anything, just show what would be done.")
+    parser.add_argument("-k", "--keep", type=int, default=None, help="Prune all but this many newest snapshot generations.")
     parser.add_argument("-l", "--keep-symlinks", action="store_true", help="Keep symbolic links. The target filesystem must support them.")
     parser.add_argument("-o", "--orphans", action="store_true", help="Don't back up; list files that are backed up but have no preimage.")
     parser.add_argument("-r", "--root", default=None, help="The path that will correspond to the backup directory. Defaults to filesystem root.")
+    parser.add_argument("-s", "--snapshot", action="store_true", help="Back up to a new deduplicated generation. The target filesystem must support hard links.")
+    parser.add_argument("-u", "--usage", action="store_true", help="Don't back up; report space used by snapshot generations.")
     parser.add_argument("-v", "--verbose", action="count", default=0, help="Be more verbose. Can be used up to 2 times.")
 
     parser.add_argument("rules", help="Path to the rules file.")
@@ -36,6 +42,10 @@ consists of glob patterns, one per line. The following headers are recognized:
 - [ignore]: Patterns that will not be backed up.
 - [zip]: Directories that will be backed up as zip files.
 - [exec]: Scripts that will be executed before the backup starts.
+
+In snapshot mode, each backup creates a new directory in generations/ of the
+backup directory. Unchanged files are hardlinked from the previous generation
+and file contents are stored only once in objects/.
 """
 
     args = Namespace()
@@ -2,12 +2,16 @@
 import logging
 import os
 import shutil
-from typing import Pattern, Set
+from typing import Optional, Pattern, Set
 
 from batchup import BatchupError
 from batchup.interrupt import ExitOnDoubleInterrupt
+from batchup.snapshot import SnapshotStore
 from batchup.target import TargetDerivation
-from batchup.tree import categorize_paths_in_tree, is_newer, needs_zip_update
+from batchup.tree import (
+    categorize_paths_in_tree, is_newer, list_included_paths_in_tree,
+    needs_zip_update
+)
 from batchup.zip import zip_directory
 
 logger: logging.Logger
@@ -15,20 +19,25 @@ logger: logging.Logger
 
 def backup_tree(
     tree: str, derivation: TargetDerivation,
-    ignore: Set[Pattern[str]], keep_symlinks: bool, dry_run: bool
+    ignore: Set[Pattern[str]], keep_symlinks: bool, dry_run: bool,
+    snapshots: Optional[SnapshotStore] = None
 ) -> None:
-    """Performs a backup of a tree."""
+    """Performs a backup of a tree.
+
+    With `snapshots`, the tree is backed up to the current generation.
+    """
     categorized_tree = categorize_paths_in_tree(tree, ignore, keep_symlinks)
     for source, category in categorized_tree:
         if category != "":
             logger.log(20, f"{category}: {source}")
             continue
         target = derivation(source)
-        if not is_newer(source, target):
+        if snapshots is not None:
+            snapshot_file(source, target, snapshots, dry_run)
+        elif not is_newer(source, target):
             logger.log(10, f"Up to date: {source}")
-            continue
-
-        backup_file(source, target, dry_run)
+        else:
+            backup_file(source, target, dry_run)
 
 
 def backup_file(source: str, target: str, dry_run: bool) -> None:
@@ -48,6 +57,45 @@ def backup_file(source: str, target: str, dry_run: bool) -> None:
                 shutil.copy(source, target)
 
 
+def snapshot_file(
+    source: str, target: str, snapshots: SnapshotStore, dry_run: bool
+) -> None:
+    """Backups source to target in the current snapshot generation.
+
+    Files unchanged since the previous generation are linked from it.
+    Other contents are copied only if they aren't in the store yet.
+    """
+    previous = snapshots.previous_target(target)
+    if previous is not None and not snapshots.is_changed(source):
+        logger.log(10, f"Up to date: {source}")
+        if not dry_run:
+            _link_previous(previous, target, snapshots)
+    elif dry_run:
+        logger.log(30, f"Would store: {source}")
+    else:
+        logger.log(30, f"Storing: {source}")
+        with ExitOnDoubleInterrupt(
+            "Interrupt received, waiting for copy to finish. Interrupt again to force exit."
+        ):
+            if os.path.islink(source):
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                _copy_link(source, target)
+            else:
+                snapshots.store_file(source, target)
+
+
+def _link_previous(
+    previous: str, target: str, snapshots: SnapshotStore
+) -> None:
+    """Carries a file over from the previous generation."""
+    if os.path.islink(previous):
+        # hardlinking a symlink would link its destination on some platforms
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        _copy_link(previous, target)
+    else:
+        snapshots.link(previous, target)
+
+
 def _copy_link(source: str, target: str) -> None:
     """Copies a symlink.
 
@@ -61,12 +109,18 @@ def _copy_link(source: str, target: str) -> None:
 
 def backup_zip(
     source: str, derivation: TargetDerivation,
-    keep_symlinks: bool, dry_run: bool
+    keep_symlinks: bool, dry_run: bool,
+    snapshots: Optional[SnapshotStore] = None
 ) -> None:
-    """Zips source and backups it to target."""
+    """Zips source and backups it to target.
+
+    With `snapshots`, the zip is backed up to the current generation.
+    """
     target = derivation(get_zip_name(source))
     target_dir = os.path.dirname(target)
-    if not needs_zip_update(source, target, keep_symlinks):
+    if snapshots is not None:
+        snapshot_zip(source, target, snapshots, keep_symlinks, dry_run)
+    elif not needs_zip_update(source, target, keep_symlinks):
         logger.log(10, f"Up to date: {source}")
     elif dry_run:
         logger.log(30, f"Would zip: {source}")
@@ -82,6 +136,43 @@ def backup_zip(
             )
 
 
+def snapshot_zip(
+    source: str, target: str, snapshots: SnapshotStore,
+    keep_symlinks: bool, dry_run: bool
+) -> None:
+    """Zips source to target in the current snapshot generation.
+
+    Zips unchanged since the previous generation are linked from it.
+    New zips are only linked to target once complete.
+    """
+    previous = snapshots.previous_target(target)
+    if previous is not None and not _is_zip_changed(source, snapshots, keep_symlinks):
+        logger.log(10, f"Up to date: {source}")
+        if not dry_run:
+            snapshots.link(previous, target)
+    elif dry_run:
+        logger.log(30, f"Would zip: {source}")
+    else:
+        logger.log(30, f"Zipping: {source}")
+        partial = snapshots.partial_path(os.path.basename(target))
+        with ExitOnDoubleInterrupt(
+            "Interrupt received, waiting for zip to finish. Interrupt again to force exit."
+        ):
+            zip_directory(
+                source, partial,
+                keep_empty_dirs=True, keep_symlinks=keep_symlinks
+            )
+            snapshots.ingest(partial, target)
+
+
+def _is_zip_changed(
+    source: str, snapshots: SnapshotStore, keep_symlinks: bool
+) -> bool:
+    """Decides whether contents of directory changed since the previous generation."""
+    included = list_included_paths_in_tree(source, set(), keep_symlinks)
+    return any(snapshots.is_changed(entry) for entry in included)
+
+
 def get_zip_name(source: str) -> str:
     """Returns the name of the zip file for a source."""
     dir_path = os.path.dirname(os.path.join(source, ""))
@@ -2,13 +2,14 @@
 import logging
 import os
 import sys
-from typing import List
+from typing import List, Optional
 
 from batchup import BatchupError
 from batchup.args import Namespace, parse_args
 from batchup.backup import backup_tree, backup_zip, inject_logger
 from batchup.orphans import list_orphans
 from batchup.rules import Rules, expand_rules, parse_rules
+from batchup.snapshot import SnapshotStore, list_generations
 from batchup.target import TargetDerivation, select_target_derivation
 
 args: Namespace
@@ -33,14 +34,45 @@ def main() -> None:
 
 
 def main_checked() -> None:
-    target_derivation = select_target_derivation(args.root, args.backup_dir)
+    snapshots = get_snapshot_store()
+    target_derivation = select_target_derivation(
+        args.root, args.backup_dir, snapshots
+    )
     rules = get_rules(args.rules)
 
     if args.orphans:
-        print_orphans(rules, target_derivation)
+        print_orphans(rules, target_derivation, snapshots)
+    elif snapshots is not None and args.usage:
+        print_usage(snapshots)
     else:
         run_execs(rules.exec)
-        run_backup(rules, target_derivation)
+        run_backup(rules, target_derivation, snapshots)
+        if snapshots is not None and args.keep is not None:
+            prune_generations(snapshots, args.keep)
+
+
+def get_snapshot_store() -> Optional[SnapshotStore]:
+    """Opens the snapshot store if snapshot mode is enabled.
+
+    Backups use a new generation, other modes use the latest one.
+    """
+    if args.keep is not None and (args.orphans or args.usage):
+        raise BatchupError("--keep can't be combined with --orphans or --usage")
+    if args.usage and args.orphans:
+        raise BatchupError("--usage can't be combined with --orphans")
+    if not args.snapshot:
+        if args.keep is not None or args.usage:
+            raise BatchupError("--keep and --usage require --snapshot")
+        return None
+    if args.keep is not None and args.keep < 1:
+        raise BatchupError("At least one generation must be kept")
+
+    if not (args.orphans or args.usage):
+        return SnapshotStore(args.backup_dir)
+    generations = list_generations(args.backup_dir)
+    if not generations:
+        raise BatchupError("No generations in backup dir")
+    return SnapshotStore(args.backup_dir, generations[-1])
 
 
 def get_rules(rules_file: str) -> Rules:
@@ -71,29 +103,81 @@ def run_execs(exec_paths: List[str]) -> None:
             os.system(exec_path)
 
 
-def run_backup(rules: Rules, target_derivation: TargetDerivation) -> None:
+def run_backup(
+    rules: Rules, target_derivation: TargetDerivation,
+    snapshots: Optional[SnapshotStore]
+) -> None:
     """Backups paths to backup_dir."""
     for source_tree in rules.copy:
         backup_tree(
             source_tree, target_derivation,
-            rules.ignore, args.keep_symlinks, args.dry_run
+            rules.ignore, args.keep_symlinks, args.dry_run, snapshots
         )
     for zip_tree in rules.zip:
         backup_zip(
             zip_tree, target_derivation,
-            args.keep_symlinks, args.dry_run
+            args.keep_symlinks, args.dry_run, snapshots
         )
 
 
-def print_orphans(rules: Rules, target_derivation: TargetDerivation) -> None:
-    """Lists files that are in backed up but not in source."""
+def prune_generations(snapshots: SnapshotStore, keep: int) -> None:
+    """Removes old generations and contents no longer used."""
+    if args.dry_run:
+        for name in snapshots.generations_to_prune(keep):
+            logger.log(30, f"Would prune: {name}")
+    else:
+        for name in snapshots.prune(keep):
+            logger.log(30, f"Pruned: {name}")
+        freed = snapshots.collect_garbage()
+        logger.log(30, f"Freed: {format_size(freed)}")
+
+
+def print_orphans(
+    rules: Rules, target_derivation: TargetDerivation,
+    snapshots: Optional[SnapshotStore]
+) -> None:
+    """Lists files that are in backed up but not in source.
+
+    In snapshot mode, the latest generation is checked.
+    """
+    backup_dir = args.backup_dir
+    if snapshots is not None:
+        backup_dir = snapshots.generation_dir
     for orphan in list_orphans(
         rules, target_derivation,
-        args.keep_symlinks, args.backup_dir
+        args.keep_symlinks, backup_dir
     ):
         print(orphan)
 
 
+def print_usage(snapshots: SnapshotStore) -> None:
+    """Lists space used by each generation and the object store."""
+    report = snapshots.report()
+    for usage in report.generations:
+        print(
+            f"{usage.name}: {usage.files} files, "
+            f"{format_size(usage.total_size)} total, "
+            f"{format_size(usage.exclusive_size)} exclusive"
+        )
+    total_size = sum(usage.total_size for usage in report.generations)
+    print(
+        f"Stored {format_size(report.stored_size)} in {report.objects} objects "
+        f"for {format_size(total_size)} in {len(report.generations)} generations"
+    )
+
+
+def format_size(size: int) -> str:
+    """Formats a number of bytes in human-readable units."""
+    if size < 1024:
+        return f"{size} B"
+    scaled = float(size)
+    for unit in ["KiB", "MiB", "GiB"]:
+        scaled /= 1024
+        if scaled < 1024:
+            return f"{scaled:.1f} {unit}"
+    return f"{scaled / 1024:.1f} TiB"
+
+
 def build_logger(verbose_count: int) -> logging.Logger:
     """Returns a logger for writing output."""
     logger = logging.getLogger("batchup")
@@ -0,0 +1,309 @@
+import calendar
+import dataclasses
+import errno
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+from typing import BinaryIO, Dict, List, Optional, Set, Tuple
+
+from batchup import BatchupError
+
+OBJECTS_DIR = "objects"
+GENERATIONS_DIR = "generations"
+# in UTC, sorts chronologically and is a valid file name on all platforms
+GENERATION_NAME_FORMAT = "%Y-%m-%d_%H-%M-%S"
+HASH_CHUNK_SIZE = 1024 * 1024
+# objects are copied under this suffix first, so interrupted copies can be told apart
+PARTIAL_SUFFIX = ".partial"
+
+
+@dataclasses.dataclass
+class GenerationUsage:
+    name: str
+    files: int
+    # sum of sizes of all files in the generation
+    total_size: int
+    # size of contents not shared with any other generation
+    exclusive_size: int
+
+
+@dataclasses.dataclass
+class SpaceReport:
+    generations: List[GenerationUsage]
+    objects: int
+    stored_size: int
+
+
+class SnapshotStore:
+    """A deduplicating store of backup generations.
+
+    Each generation is a directory mirroring the source tree.
+    File contents are stored once in a content-addressed object store
+    and hardlinked into the generations which contain them.
+    """
+    def __init__(self, backup_dir: str, generation: Optional[str] = None) -> None:
+        """Opens the store in `backup_dir`.
+
+        Unless `generation` is given, a new one named after the current time is used.
+        It must sort after all existing generations.
+        """
+        self.backup_dir = backup_dir
+        self.objects_dir = os.path.join(backup_dir, OBJECTS_DIR)
+        self.generations_dir = os.path.join(backup_dir, GENERATIONS_DIR)
+        if generation is None:
+            generation = time.strftime(GENERATION_NAME_FORMAT, time.gmtime())
+            existing = list_generations(backup_dir)
+            if existing and generation <= existing[-1]:
+                raise BatchupError(
+                    f"Generation {generation} isn't newer than {existing[-1]}"
+                )
+        self.generation_dir = os.path.join(self.generations_dir, generation)
+
+        older = [name for name in list_generations(backup_dir) if name < generation]
+        self.previous_dir: Optional[str] = None
+        self.previous_time: Optional[float] = None
+        if older:
+            self.previous_dir = os.path.join(self.generations_dir, older[-1])
+            self.previous_time = _generation_time(older[-1])
+        # object keys of files found to have too many links, by (device, inode)
+        self._full_keys: Dict[Tuple[int, int], str] = {}
+
+    def previous_target(self, target: str) -> Optional[str]:
+        """Returns the counterpart of target in the previous generation.
+
+        Returns None if there is no such file.
+        """
+        if self.previous_dir is None:
+            return None
+        relpath = os.path.relpath(target, self.generation_dir)
+        previous = os.path.join(self.previous_dir, relpath)
+        if not os.path.lexists(previous):
+            return None
+        return previous
+
+    def is_changed(self, source: str) -> bool:
+        """Tests if source was modified since the previous generation started.
+
+        Generation files share mtimes with other links to their objects,
+        so they can't tell on their own whether their source changed.
+        """
+        if self.previous_time is None:
+            return True
+        # using lstat to avoid following symlinks
+        return os.lstat(source).st_mtime >= self.previous_time
+
+    def store_file(self, source: str, target: str) -> None:
+        """Stores contents of source and links them to target.
+
+        The contents are only copied if they aren't in the store yet.
+        """
+        obj = self._object_path(_object_key(source))
+        if not os.path.exists(obj):
+            obj = self._store_copy(source)
+        self.link(obj, target)
+
+    def partial_path(self, name: str) -> str:
+        """Returns a path where a file can be written before it's ingested."""
+        os.makedirs(self.objects_dir, exist_ok=True)
+        return os.path.join(self.objects_dir, name + PARTIAL_SUFFIX)
+
+    def ingest(self, partial: str, target: str) -> None:
+        """Moves a file written to a partial path into the store and links it to target."""
+        obj = self._object_path(_object_key(partial))
+        if not os.path.exists(obj):
+            os.makedirs(os.path.dirname(obj), exist_ok=True)
+            os.replace(partial, obj)
+        else:
+            os.remove(partial)
+        self.link(obj, target)
+
+    def link(self, existing: str, target: str) -> None:
+        """Hardlinks an existing file to target.
+
+        If the file has too many links already, its object is linked instead.
+        Throws an exception if the link can't be created.
+        """
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        try:
+            try:
+                os.link(existing, target)
+            except OSError as e:
+                if e.errno != errno.EMLINK:
+                    raise
+                self._link_object(existing, target)
+        except OSError as e:
+            raise BatchupError("Hardlink creation failed") from e
+
+    def _link_object(self, existing: str, target: str) -> None:
+        """Links target to the current object with contents of an existing file.
+
+        If the object has too many links as well, it is replaced by a fresh copy.
+        Generations keep the old copy, later links go to the new one.
+        """
+        stat = os.stat(existing)
+        inode = (stat.st_dev, stat.st_ino)
+        if inode not in self._full_keys:
+            self._full_keys[inode] = _object_key(existing)
+        obj = self._object_path(self._full_keys[inode])
+        if os.path.exists(obj) and not os.path.samefile(obj, existing):
+            try:
+                os.link(obj, target)
+                return
+            except OSError as e:
+                if e.errno != errno.EMLINK:
+                    raise
+        obj = self._store_copy(existing, replace=True)
+        os.link(obj, target)
+
+    def generations_to_prune(self, keep: int) -> List[str]:
+        """Returns names of generations beyond the newest `keep` ones.
+
+        The current generation counts even if it hasn't been created,
+        so that dry runs prune the same generations as real ones.
+        """
+        generations = list_generations(self.backup_dir)
+        current = os.path.basename(self.generation_dir)
+        if current not in generations:
+            generations = sorted(generations + [current])
+        return generations[:max(len(generations) - keep, 0)]
+
+    def prune(self, keep: int) -> List[str]:
+        """Removes all but the newest `keep` generations.
+
+        Returns names of the removed generations.
+        """
+        pruned = self.generations_to_prune(keep)
+        for name in pruned:
+            shutil.rmtree(os.path.join(self.generations_dir, name))
+        return pruned
+
+    def collect_garbage(self) -> int:
+        """Removes objects which aren't linked from any generation.
+
+        Leftovers of interrupted copies are removed as well.
+        Returns the number of bytes freed.
+        """
+        freed = 0
+        for obj in _list_files(self.objects_dir):
+            stat = os.lstat(obj)
+            # the only remaining link is the store itself
+            if stat.st_nlink <= 1:
+                os.remove(obj)
+                freed += stat.st_size
+        return freed
+
+    def report(self) -> SpaceReport:
+        """Accounts for space used by generations and the object store."""
+        # generations referencing each file, identified by (device, inode)
+        referrers: Dict[Tuple[int, int], Set[str]] = {}
+        sizes: Dict[Tuple[int, int], int] = {}
+        usages: List[GenerationUsage] = []
+        for name in list_generations(self.backup_dir):
+            usage = GenerationUsage(name, 0, 0, 0)
+            for path in _list_files(os.path.join(self.generations_dir, name)):
+                stat = os.lstat(path)
+                key = (stat.st_dev, stat.st_ino)
+                referrers.setdefault(key, set()).add(name)
+                sizes[key] = stat.st_size
+                usage.files += 1
+                usage.total_size += stat.st_size
+            usages.append(usage)
+
+        by_name = {usage.name: usage for usage in usages}
+        for key, names in referrers.items():
+            if len(names) == 1:
+                by_name[next(iter(names))].exclusive_size += sizes[key]
+
+        objects = 0
+        stored_size = 0
+        for obj in _list_files(self.objects_dir):
+            if obj.endswith(PARTIAL_SUFFIX):
+                continue
+            objects += 1
+            stored_size += os.lstat(obj).st_size
+        return SpaceReport(usages, objects, stored_size)
+
+    def _store_copy(self, source: str, replace: bool = False) -> str:
+        """Copies source into the store and returns the path to its object.
+
+        The object is keyed by the bytes actually copied,
+        so a source modified meanwhile can't end up under a wrong key.
+        An existing object with the same key is kept unless `replace` is set.
+        """
+        os.makedirs(self.objects_dir, exist_ok=True)
+        fd, partial = tempfile.mkstemp(suffix=PARTIAL_SUFFIX, dir=self.objects_dir)
+        with open(source, "rb") as src, os.fdopen(fd, "wb") as dst:
+            mode = _file_mode(src)
+            key = _hash_object(src, mode, dst)
+        os.chmod(partial, mode)
+
+        obj = self._object_path(key)
+        if os.path.exists(obj) and not replace:
+            os.remove(partial)
+        else:
+            os.makedirs(os.path.dirname(obj), exist_ok=True)
+            os.replace(partial, obj)
+        return obj
+
+    def _object_path(self, digest: str) -> str:
+        """Returns the path to the object with given key."""
+        # fan out to keep directories small
+        return os.path.join(self.objects_dir, digest[:2], digest[2:])
+
+
+def list_generations(backup_dir: str) -> List[str]:
+    """Returns names of existing generations, oldest first."""
+    generations_dir = os.path.join(backup_dir, GENERATIONS_DIR)
+    if not os.path.isdir(generations_dir):
+        return []
+    return sorted(os.listdir(generations_dir))
+
+
+def _generation_time(name: str) -> float:
+    """Returns the time a generation was started as a timestamp."""
+    try:
+        return calendar.timegm(time.strptime(name, GENERATION_NAME_FORMAT))
+    except ValueError as e:
+        raise BatchupError(f"Invalid generation name: {name}") from e
+
+
+def _object_key(path: str) -> str:
+    """Returns the object key of a file."""
+    with open(path, "rb") as f:
+        return _hash_object(f, _file_mode(f))
+
+
+def _hash_object(
+    f: BinaryIO, mode: int, copy_to: Optional[BinaryIO] = None
+) -> str:
+    """Returns a hex digest of the permissions and contents of an open file.
+
+    Links share permissions, so files differing only in them need separate objects.
+    If `copy_to` is given, the hashed contents are written to it as well.
+    """
+    digest = hashlib.sha256()
+    digest.update(f"{mode:o}\n".encode())
+    for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+        digest.update(chunk)
+        if copy_to is not None:
+            copy_to.write(chunk)
+    return digest.hexdigest()
+
+
+def _file_mode(f: BinaryIO) -> int:
+    """Returns the permission bits of an open file."""
+    return os.fstat(f.fileno()).st_mode & 0o7777
+
+
+def _list_files(tree: str) -> List[str]:
+    """Returns paths to all non-directories in a tree."""
+    paths: List[str] = []
+    for dir_path, dir_names, file_names in os.walk(tree):
+        for name in dir_names + file_names:
+            path = os.path.join(dir_path, name)
+            # symlinks to directories are listed, but not followed
+            if name in file_names or os.path.islink(path):
+                paths.append(path)
+    return paths
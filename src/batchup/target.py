@@ -2,6 +2,7 @@ import os
 from typing import Callable, Optional
 
 from batchup import BatchupError
+from batchup.snapshot import SnapshotStore
 
 
 class DerivationError(BatchupError):
@@ -13,9 +14,19 @@ TargetDerivation = Callable[[str], str]
 
 
 def select_target_derivation(
-        root: Optional[str], backup_dir: str
+        root: Optional[str], backup_dir: str,
+        snapshots: Optional[SnapshotStore] = None
 ) -> TargetDerivation:
-    """Selects a function to derive backup target from source."""
+    """Selects a function to derive backup target from source.
+
+    With `snapshots`, targets are placed in the current snapshot generation.
+    """
+    if snapshots is not None:
+        if root is not None and _is_subdir(root, backup_dir):
+            raise BatchupError(
+                "Root can't be a subdirectory of backup dir"
+            )
+        backup_dir = snapshots.generation_dir
     if root is None:
         return get_default_target_derivation(backup_dir)
     else: